@@ -1,10 +1,17 @@
-from typing import Sequence
+from typing import Literal, Sequence
 
-from advanced_alchemy.exceptions import NotFoundError
+from advanced_alchemy.exceptions import IntegrityError, NotFoundError
 from advanced_alchemy.filters import CollectionFilter
-from litestar import Controller, delete, get, patch, post
+from litestar import Controller, Request, delete, get, patch, post
 from litestar.dto import DTOData
-from litestar.exceptions import NotFoundException
+from litestar.exceptions import ClientException, NotFoundException, ServiceUnavailableException
+from litestar.status_codes import (
+    HTTP_202_ACCEPTED,
+    HTTP_409_CONFLICT,
+    HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+)
+from sqlalchemy import Engine
 
 from app.dtos import (
     UserCreateDTO,
@@ -26,11 +33,15 @@ from app.dtos import (
     ActivityUpdateDTO,
     ExpenseCreateDTO,
     ExpenseReadDTO,
+    ExpenseReadFlatDTO,
     ExpenseUpdateDTO,
     CityCreateDTO,
     CityReadDTO,
     CityUpdateDTO,
+    SpendingTimeseries,
+    ImportJob,
 )
+from app.imports import get_import_job, reserve_import, save_upload, start_import
 from app.models import User, Travel, Accommodation, Transport, Activity, Expense, City
 from app.repositories import (
     UserRepository,
@@ -73,15 +84,16 @@ class UserController(Controller):
     @patch("/{user_id:int}", dto=UserUpdateDTO)
     async def update_user(self, user_repo: UserRepository, user_id: int, data: DTOData[User]) -> User:
         try:
-            user, _ = user_repo.get_and_update(id=user_id, **data.as_builtins(), match_fields=["id"])
-            return user
+            return user_repo.update_returning(user_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Usuario {user_id} no encontrado") from e
 
     @delete("/{user_id:int}")
     async def delete_user(self, user_repo: UserRepository, user_id: int) -> None:
         try:
-            user_repo.delete(user_id)
+            user_repo.delete_returning(user_id)
+        except IntegrityError as e:
+            raise ClientException(status_code=HTTP_409_CONFLICT, detail=f"Usuario {user_id} tiene gastos asociados") from e
         except NotFoundError as e:
             raise NotFoundException(detail=f"Usuario {user_id} no encontrado") from e
 
@@ -120,10 +132,7 @@ class AccommodationController(Controller):
         data: DTOData[Accommodation],
     ) -> Accommodation:
         try:
-            accommodation, _ = accommodation_repo.get_and_update(
-                id=accommodation_id, **data.as_builtins(), match_fields=["id"]
-            )
-            return accommodation
+            return accommodation_repo.update_returning(accommodation_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Alojamiento {accommodation_id} no encontrado") from e
 
@@ -132,7 +141,7 @@ class AccommodationController(Controller):
         self, accommodation_repo: AccommodationRepository, accommodation_id: int
     ) -> None:
         try:
-            accommodation_repo.delete(accommodation_id)
+            accommodation_repo.delete_returning(accommodation_id)
         except NotFoundError as e:
             raise NotFoundException(detail=f"Alojamiento {accommodation_id} no encontrado") from e
 
@@ -171,10 +180,7 @@ class TransportController(Controller):
         data: DTOData[Transport],
     ) -> Transport:
         try:
-            transport, _ = transport_repo.get_and_update(
-                id=transport_id, **data.as_builtins(), match_fields=["id"]
-            )
-            return transport
+            return transport_repo.update_returning(transport_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Transporte {transport_id} no encontrado") from e
 
@@ -183,7 +189,7 @@ class TransportController(Controller):
         self, transport_repo: TransportRepository, transport_id: int
     ) -> None:
         try:
-            transport_repo.delete(transport_id)
+            transport_repo.delete_returning(transport_id)
         except NotFoundError as e:
             raise NotFoundException(detail=f"Transporte {transport_id} no encontrado") from e
 
@@ -222,10 +228,7 @@ class ActivityController(Controller):
         data: DTOData[Activity],
     ) -> Activity:
         try:
-            activity, _ = activity_repo.get_and_update(
-                id=activity_id, **data.as_builtins(), match_fields=["id"]
-            )
-            return activity
+            return activity_repo.update_returning(activity_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Actividad {activity_id} no encontrada") from e
 
@@ -234,7 +237,7 @@ class ActivityController(Controller):
         self, activity_repo: ActivityRepository, activity_id: int
     ) -> None:
         try:
-            activity_repo.delete(activity_id)
+            activity_repo.delete_returning(activity_id)
         except NotFoundError as e:
             raise NotFoundException(detail=f"Actividad {activity_id} no encontrada") from e
 
@@ -259,7 +262,7 @@ class ExpenseController(Controller):
         except NotFoundError as e:
             raise NotFoundException(detail=f"Gasto {expense_id} no encontrado") from e
 
-    @patch("/{expense_id:int}", dto=ExpenseUpdateDTO)
+    @patch("/{expense_id:int}", dto=ExpenseUpdateDTO, return_dto=ExpenseReadFlatDTO)
     async def update_expense(
         self,
         expense_repo: ExpenseRepository,
@@ -267,10 +270,7 @@ class ExpenseController(Controller):
         data: DTOData[Expense],
     ) -> Expense:
         try:
-            expense, _ = expense_repo.get_and_update(
-                id=expense_id, **data.as_builtins(), match_fields=["id"]
-            )
-            return expense
+            return expense_repo.update_returning(expense_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Gasto {expense_id} no encontrado") from e
 
@@ -279,7 +279,7 @@ class ExpenseController(Controller):
         self, expense_repo: ExpenseRepository, expense_id: int
     ) -> None:
         try:
-            expense_repo.delete(expense_id)
+            expense_repo.delete_returning(expense_id)
         except NotFoundError as e:
             raise NotFoundException(detail=f"Gasto {expense_id} no encontrado") from e
 
@@ -300,14 +300,16 @@ class CityController(Controller):
     @patch("/{city_id:int}", dto=CityUpdateDTO)
     async def update_city(self, city_repo: CityRepository, city_id: int, data: DTOData[City]) -> City:
         try:
-            city, _ = city_repo.get_and_update(id=city_id, **data.as_builtins(), match_fields=["id"])
-            return city
+            return city_repo.update_returning(city_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Ciudad {city_id} no encontrada") from e
         
     @delete("/{city_id:int}")
     async def delete_city(self, city_repo: CityRepository, city_id: int) -> None:
-        city_repo.delete(city_id)
+        try:
+            city_repo.delete_returning(city_id)
+        except NotFoundError as e:
+            raise NotFoundException(detail=f"Ciudad {city_id} no encontrada") from e
 
 class TravelController(Controller):
     path = "/travels"
@@ -336,18 +338,19 @@ class TravelController(Controller):
     async def add_travel(self, travel_repo: TravelRepository, data: Travel) -> Travel:
         return travel_repo.add(data)
 
-    @patch("/{travel_id:int}", dto=TravelUpdateDTO)
+    @patch("/{travel_id:int}", dto=TravelUpdateDTO, return_dto = TravelReadDTO)
     async def update_travel(self, travel_repo: TravelRepository, travel_id: int, data: DTOData[Travel]) -> Travel:
         try:
-            travel, _ = travel_repo.get_and_update(id=travel_id, **data.as_builtins(), match_fields=["id"])
-            return travel
+            return travel_repo.update_returning(travel_id, data.as_builtins())
         except NotFoundError as e:
             raise NotFoundException(detail=f"Viaje {travel_id} no encontrado") from e
 
     @delete("/{travel_id:int}", return_dto = TravelReadDTO)
     async def delete_travel(self, travel_repo: TravelRepository, travel_id: int) -> None:
         try:
-            travel_repo.delete(travel_id)
+            travel_repo.delete_returning(travel_id)
+        except IntegrityError as e:
+            raise ClientException(status_code=HTTP_409_CONFLICT, detail=f"Viaje {travel_id} tiene alojamientos, transportes, actividades o gastos asociados") from e
         except NotFoundError as e:
             raise NotFoundException(detail=f"Viaje {travel_id} no encontrado") from e
 
@@ -428,4 +431,46 @@ class TravelController(Controller):
         if not expense:
             raise NotFoundException(detail=f"No hay gastos encontrados para el viaje con ID {travel_id}")
         return expense
-    
\ No newline at end of file
+
+    @get("/{travel_id:int}/spending/timeseries")
+    async def get_travel_spending_timeseries(
+        self,
+        expense_repo: ExpenseRepository,
+        travel_id: int,
+        resolution: Literal["day", "week", "month"] = "day",
+        group_by: Literal["travel", "user"] = "travel",
+    ) -> SpendingTimeseries:
+        try:
+            return expense_repo.spending_timeseries(travel_id, resolution=resolution, group_by=group_by)
+        except NotFoundError as e:
+            raise NotFoundException(detail=f"Viaje {travel_id} no encontrado") from e
+
+    @post("/{travel_id:int}/import", status_code=HTTP_202_ACCEPTED)
+    async def import_travel_csv(
+        self, request: Request, db_engine: Engine, travel_repo: TravelRepository, travel_id: int
+    ) -> ImportJob:
+        try:
+            travel_repo.get(travel_id)
+        except NotFoundError as e:
+            raise NotFoundException(detail=f"Viaje {travel_id} no encontrado") from e
+        # El cuerpo es el CSV crudo (Content-Type: text/csv), no un formulario multipart
+        if request.content_type[0].startswith("multipart/"):
+            raise ClientException(
+                status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="Envíe el CSV como cuerpo crudo (text/csv), no como formulario multipart",
+            )
+        job = reserve_import(travel_id)
+        if job is None:
+            raise ServiceUnavailableException(detail="Hay demasiadas importaciones en curso, intente más tarde")
+        try:
+            path = await save_upload(job, request.stream())
+        except ValueError as e:
+            raise ClientException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)) from e
+        return start_import(job, path, db_engine)
+
+    @get("/{travel_id:int}/import/{job_id:str}")
+    async def get_travel_import(self, travel_id: int, job_id: str) -> ImportJob:
+        job = get_import_job(job_id)
+        if job is None or job.travel_id != travel_id:
+            raise NotFoundException(detail=f"Importación {job_id} no encontrada para el viaje {travel_id}")
+        return job
@@ -1,3 +1,6 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
 from advanced_alchemy.extensions.litestar import SQLAlchemyDTO, SQLAlchemyDTOConfig
 
 from app.models import Accommodation, Transport, Activity, Expense, City, Travel, User
@@ -46,6 +49,9 @@ class ActivityUpdateDTO(SQLAlchemyDTO[Activity]):
 class ExpenseReadDTO(SQLAlchemyDTO[Expense]):
     config = SQLAlchemyDTOConfig(exclude={"travel", "user"})
 
+class ExpenseReadFlatDTO(SQLAlchemyDTO[Expense]):
+    config = SQLAlchemyDTOConfig(exclude={"travel", "user", "accommodation", "transport", "activity"})
+
 class ExpenseCreateDTO(SQLAlchemyDTO[Expense]):
     config = SQLAlchemyDTOConfig(exclude={"id", "travel", "user", "accommodation", "transport", "activity"})
 
@@ -90,3 +96,60 @@ class UserCreateDTO(SQLAlchemyDTO[User]):
 
 class UserUpdateDTO(SQLAlchemyDTO[User]):
     config = SQLAlchemyDTOConfig(exclude={"id", "travels", "expenses"}, partial=True)
+
+
+# Spending DTOs
+@dataclass
+class SpendingPoint:
+    period: str
+    user_id: Optional[int]
+    total: int
+    count: int
+    cumulative: int
+    rolling_average: float
+
+
+@dataclass
+class SpendingStatistics:
+    user_id: Optional[int]
+    total: int
+    mean: float
+    min: int
+    max: int
+    p50: float
+    p90: float
+    p95: float
+
+
+@dataclass
+class SpendingTimeseries:
+    travel_id: int
+    resolution: str
+    group_by: str
+    planned_accommodations: int
+    planned_transports: int
+    planned_activities: int
+    planned_total: int
+    spent_total: int
+    remaining: int
+    series: list[SpendingPoint]
+    statistics: list[SpendingStatistics]
+
+
+# Import DTOs
+@dataclass
+class ImportRowError:
+    line: int
+    message: str
+
+
+@dataclass
+class ImportJob:
+    id: str
+    travel_id: int
+    status: str = "pending"
+    rows_processed: int = 0
+    rows_imported: int = 0
+    error_count: int = 0
+    errors: list[ImportRowError] = field(default_factory=list)
+    detail: Optional[str] = None
@@ -0,0 +1,193 @@
+import csv
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Any, AsyncIterator, Optional
+from uuid import uuid4
+
+import anyio
+import msgspec
+from advanced_alchemy.extensions.litestar import SQLAlchemyDTO
+from litestar.types import Empty
+from sqlalchemy import Engine, insert, select
+from sqlalchemy.orm import Session
+
+from app.dtos import (
+    AccommodationCreateDTO,
+    ActivityCreateDTO,
+    ExpenseCreateDTO,
+    ImportJob,
+    ImportRowError,
+    TransportCreateDTO,
+)
+from app.models import Base, Accommodation, Transport, Activity, Expense, City, User
+from app.repositories import invalidate_spending
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+IMPORT_MAX_JOBS = 100
+IMPORT_MAX_ACTIVE = 10
+IMPORT_MAX_BYTES = 512 * 1024 * 1024
+
+# Columnas *_id que pueden venir como nombre en el CSV (p. ej. "city" en vez de "city_id")
+NAME_LOOKUPS = {"user_id": "users", "city_id": "cities", "start_city_id": "cities", "end_city_id": "cities"}
+
+
+def _import_row_struct(model: type[Base], dto: type[SQLAlchemyDTO]) -> type[msgspec.Struct]:
+    # Los campos y tipos de cada fila son los mismos que acepta el DTO de creación
+    fields = [
+        (definition.name, definition.annotation, msgspec.NODEFAULT if definition.default is Empty else definition.default)
+        for definition in dto.generate_field_definitions(model)
+        if definition.name not in dto.config.exclude
+    ]
+    return msgspec.defstruct(f"{model.__name__}ImportRow", fields, kw_only=True)
+
+
+IMPORT_KINDS = {
+    "expense": (Expense, _import_row_struct(Expense, ExpenseCreateDTO)),
+    "accommodation": (Accommodation, _import_row_struct(Accommodation, AccommodationCreateDTO)),
+    "transport": (Transport, _import_row_struct(Transport, TransportCreateDTO)),
+    "activity": (Activity, _import_row_struct(Activity, ActivityCreateDTO)),
+}
+
+_import_jobs: OrderedDict[str, ImportJob] = OrderedDict()
+_import_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import")
+
+
+def reserve_import(travel_id: int) -> Optional[ImportJob]:
+    # Limita las importaciones pendientes o en curso (y sus archivos temporales en disco)
+    if sum(job.status in ("pending", "running") for job in _import_jobs.values()) >= IMPORT_MAX_ACTIVE:
+        return None
+    job = ImportJob(id=uuid4().hex, travel_id=travel_id)
+    _import_jobs[job.id] = job
+    for job_id in [job_id for job_id, old in _import_jobs.items() if old.status in ("completed", "failed")]:
+        if len(_import_jobs) <= IMPORT_MAX_JOBS:
+            break
+        del _import_jobs[job_id]
+    return job
+
+
+async def save_upload(job: ImportJob, stream: AsyncIterator[bytes]) -> str:
+    # El cuerpo (CSV crudo) se vuelca por bloques a un archivo temporal, sin retenerlo en
+    # memoria y escribiendo en un hilo para no bloquear el event loop; si la subida se
+    # corta o excede IMPORT_MAX_BYTES se borra el archivo y se libera el trabajo reservado
+    descriptor, path = tempfile.mkstemp(suffix=".csv")
+    os.close(descriptor)
+    try:
+        size = 0
+        async with await anyio.open_file(path, "wb") as file:
+            async for chunk in stream:
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise ValueError(f"El archivo excede el máximo de {IMPORT_MAX_BYTES} bytes")
+                await file.write(chunk)
+    except BaseException:
+        os.remove(path)
+        _import_jobs.pop(job.id, None)
+        raise
+    return path
+
+
+def start_import(job: ImportJob, path: str, engine: Engine) -> ImportJob:
+    _import_executor.submit(_run_import, job, path, engine)
+    return get_import_job(job.id)
+
+
+def get_import_job(job_id: str) -> Optional[ImportJob]:
+    job = _import_jobs.get(job_id)
+    return replace(job, errors=list(job.errors)) if job is not None else None
+
+
+def _add_error(job: ImportJob, line: int, message: str) -> None:
+    job.error_count += 1
+    if len(job.errors) < IMPORT_MAX_ERRORS:
+        job.errors.append(ImportRowError(line=line, message=message))
+
+
+def _build_lookups(session: Session) -> dict[str, dict[str, Optional[int]]]:
+    # Nombre -> id; los nombres repetidos quedan en None por ser ambiguos
+    lookups: dict[str, dict[str, Optional[int]]] = {}
+    for lookup, model in (("users", User), ("cities", City)):
+        ids: dict[str, Optional[int]] = {}
+        for name, item_id in session.execute(select(model.name, model.id)):
+            ids[name] = None if name in ids else item_id
+        lookups[lookup] = ids
+    return lookups
+
+
+def _parse_row(
+    row: dict[str, Optional[str]], travel_id: int, lookups: dict[str, dict[str, Optional[int]]]
+) -> tuple[type[Base], dict[str, Any]]:
+    values = {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+    kind = values.pop("row_type", "").lower()
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Tipo de fila desconocido: '{kind}'")
+    model, struct = IMPORT_KINDS[kind]
+
+    for field_name in struct.__struct_fields__:
+        name = values.pop(field_name.removesuffix("_id"), None) if field_name in NAME_LOOKUPS else None
+        if name is None or field_name in values:
+            continue
+        ids = lookups[NAME_LOOKUPS[field_name]]
+        if name not in ids:
+            raise ValueError(f"'{name}' no encontrado para {field_name}")
+        if ids[name] is None:
+            raise ValueError(f"'{name}' es ambiguo para {field_name}, use el id")
+        values[field_name] = ids[name]
+
+    values["travel_id"] = travel_id
+    return model, msgspec.structs.asdict(msgspec.convert(values, struct, strict=False))
+
+
+def _insert_chunk(session: Session, job: ImportJob, model: type[Base], chunk: list[tuple[int, dict[str, Any]]]) -> None:
+    try:
+        session.execute(insert(model.__table__), [values for _, values in chunk])
+        session.commit()
+        job.rows_imported += len(chunk)
+        invalidate_spending(job.travel_id)
+    except Exception:
+        # Errores de la base y también de conversión del driver (p. ej. OverflowError en enteros enormes)
+        session.rollback()
+        # Si el bloque falla se reintenta fila a fila para reportar qué filas tienen error
+        for line, values in chunk:
+            try:
+                session.execute(insert(model.__table__), [values])
+                session.commit()
+                job.rows_imported += 1
+                invalidate_spending(job.travel_id)
+            except Exception as e:
+                session.rollback()
+                _add_error(job, line, str(getattr(e, "orig", e)))
+
+
+def _run_import(job: ImportJob, path: str, engine: Engine) -> None:
+    job.status = "running"
+    try:
+        with Session(engine) as session, open(path, newline="", encoding="utf-8-sig") as file:
+            lookups = _build_lookups(session)
+            chunks: dict[type[Base], list[tuple[int, dict[str, Any]]]] = {model: [] for model, _ in IMPORT_KINDS.values()}
+            reader = csv.DictReader(file)
+            for row in reader:
+                job.rows_processed += 1
+                try:
+                    model, values = _parse_row(row, job.travel_id, lookups)
+                except (ValueError, msgspec.ValidationError) as e:
+                    _add_error(job, reader.line_num, str(e))
+                    continue
+                chunk = chunks[model]
+                chunk.append((reader.line_num, values))
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    _insert_chunk(session, job, model, chunk)
+                    chunk.clear()
+            for model, chunk in chunks.items():
+                if chunk:
+                    _insert_chunk(session, job, model, chunk)
+        job.status = "completed"
+    except Exception as e:
+        # El executor descarta las excepciones: el trabajo nunca debe quedar en "running"
+        job.status = "failed"
+        job.detail = str(e)
+    finally:
+        os.remove(path)
@@ -105,7 +105,7 @@ class Expense(Base):
     datetime: Mapped[date]
 
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    travel_id: Mapped[int] = mapped_column(ForeignKey("travels.id"))
+    travel_id: Mapped[int] = mapped_column(ForeignKey("travels.id"), index=True)
     accommodation_id: Mapped[Optional[int]] = mapped_column(ForeignKey("accommodations.id"), nullable=True)
     transport_id: Mapped[Optional[int]] = mapped_column(ForeignKey("transport.id"), nullable=True)
     activity_id: Mapped[Optional[int]] = mapped_column(ForeignKey("activities.id"), nullable=True)
@@ -1,12 +1,137 @@
+from collections import OrderedDict
+from statistics import quantiles
+from threading import Lock
+from time import monotonic
+from typing import Any, Optional, TypeVar
+
+from advanced_alchemy.exceptions import IntegrityError, NotFoundError, wrap_sqlalchemy_exception
 from advanced_alchemy.repository import SQLAlchemySyncRepository
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, delete, func, null, select, true, update
+from sqlalchemy.orm import RelationshipDirection, Session
+
+from app.dtos import SpendingPoint, SpendingStatistics, SpendingTimeseries
+from app.models import Base, Accommodation, Transport, Activity, Expense, City, Travel, User
+
+ModelT = TypeVar("ModelT", bound=Base)
+
+# Cada periodo se identifica por la fecha en que empieza (las semanas, por su lunes)
+SPENDING_PERIOD_MODIFIERS = {"day": (), "week": ("weekday 0", "-6 days"), "month": ("start of month",)}
+SPENDING_PERIOD_STEPS = {"day": "+1 day", "week": "+7 days", "month": "+1 month"}
+SPENDING_ROLLING_WINDOW = 7
+SPENDING_CACHE_SIZE = 256
+SPENDING_CACHE_TTL = 30
+
+# (travel_id, resolution, group_by) -> (versión del viaje, expiración, resultado)
+_spending_cache: OrderedDict[tuple[int, str, str], tuple[tuple[int, int], float, SpendingTimeseries]] = OrderedDict()
+# Contador por viaje que incrementan las escrituras de gastos y precios planificados;
+# _spending_epoch invalida todos los viajes a la vez. Vive en memoria de este proceso:
+# solo ve las escrituras hechas por los repositorios (e importaciones) de este mismo proceso.
+# Con varios workers o escrituras externas sobre la base, SPENDING_CACHE_TTL acota cuánto
+# tiempo se puede servir un resultado desactualizado.
+_spending_versions: dict[int, int] = {}
+_spending_epoch = 0
+_spending_lock = Lock()
+
+
+def invalidate_spending(travel_id: Optional[int] = None) -> None:
+    global _spending_epoch
+    with _spending_lock:
+        if travel_id is None:
+            _spending_epoch += 1
+        else:
+            _spending_versions[travel_id] = _spending_versions.get(travel_id, 0) + 1
+
+
+def _spending_version(travel_id: int) -> tuple[int, int]:
+    with _spending_lock:
+        return _spending_epoch, _spending_versions.get(travel_id, 0)
+
+
+# Base Repository
+class ReturningRepository(SQLAlchemySyncRepository[ModelT]):  # type: ignore
+    # PATCH y DELETE en una sola sentencia (UPDATE/DELETE ... RETURNING, SQLite >= 3.35),
+    # sin cargar la fila en la sesión antes de modificarla.
+
+    # Columna con el viaje afectado por las escrituras, para invalidar el caché de gastos
+    spending_travel_key: Optional[str] = None
+
+    def add(self, data: ModelT, **kwargs: Any) -> ModelT:
+        instance = super().add(data, **kwargs)
+        if self.spending_travel_key is not None:
+            invalidate_spending(getattr(instance, self.spending_travel_key))
+        return instance
 
-from app.models import Accommodation, Transport, Activity, Expense, City, Travel, User
+    def update_returning(self, item_id: int, data: dict[str, Any], auto_commit: Optional[bool] = None) -> ModelT:
+        model = self.model_type
+        columns = model.__table__.columns
+        if data:
+            statement = (
+                update(model)
+                .where(model.id == item_id)
+                .values(**data)
+                .returning(*columns)
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            statement = select(*columns).where(model.id == item_id)
+        with wrap_sqlalchemy_exception():
+            row = self.session.execute(statement).one_or_none()
+            if row is None:
+                raise NotFoundError(f"No item found when filtering by id={item_id}")
+            self._flush_or_commit(auto_commit=auto_commit)
+        if self.spending_travel_key is not None:
+            # Si cambia de viaje no se conoce el anterior: se invalidan todos
+            invalidate_spending(None if self.spending_travel_key in data else row._mapping[self.spending_travel_key])
+        return model(**row._mapping)
+
+    def delete_returning(self, item_id: int, auto_commit: Optional[bool] = None) -> int:
+        model = self.model_type
+        relationships = model.__mapper__.relationships
+        with wrap_sqlalchemy_exception():
+            # Sin el ORM hay que replicar lo que hacía al borrar: las asociaciones
+            # (users_travels) se eliminan, las FK nulables de los hijos quedan en NULL
+            # y los hijos con FK obligatoria impiden el borrado.
+            for relationship in relationships:
+                if relationship.direction is not RelationshipDirection.ONETOMANY:
+                    continue
+                for _, child_column in relationship.synchronize_pairs:
+                    if not child_column.nullable and self.session.execute(
+                        select(child_column).where(child_column == item_id).limit(1)
+                    ).first() is not None:
+                        raise IntegrityError(f"{child_column.table.name}.{child_column.name} aún referencia id={item_id}")
+            for relationship in relationships:
+                if relationship.secondary is not None:
+                    for _, secondary_column in relationship.synchronize_pairs:
+                        self.session.execute(delete(relationship.secondary).where(secondary_column == item_id))
+                elif relationship.direction is RelationshipDirection.ONETOMANY:
+                    # Las FK obligatorias ya se comprobaron vacías arriba: solo se anulan las nulables
+                    for _, child_column in relationship.synchronize_pairs:
+                        if not child_column.nullable:
+                            continue
+                        self.session.execute(
+                            update(child_column.table).where(child_column == item_id).values({child_column.name: None})
+                        )
+            returning = [model.id]
+            if self.spending_travel_key is not None:
+                returning.append(getattr(model, self.spending_travel_key))
+            row = self.session.execute(
+                delete(model)
+                .where(model.id == item_id)
+                .returning(*returning)
+                .execution_options(synchronize_session=False)
+            ).one_or_none()
+            if row is None:
+                raise NotFoundError(f"No item found when filtering by id={item_id}")
+            self._flush_or_commit(auto_commit=auto_commit)
+        if self.spending_travel_key is not None:
+            invalidate_spending(row[1])
+        return row[0]
 
 
 # Accommodation Repository
-class AccommodationRepository(SQLAlchemySyncRepository[Accommodation]):  # type: ignore
+class AccommodationRepository(ReturningRepository[Accommodation]):  # type: ignore
     model_type = Accommodation
+    spending_travel_key = "travel_id"
 
 
 async def provide_accommodation_repo(db_session: Session) -> AccommodationRepository:
@@ -14,8 +139,9 @@ async def provide_accommodation_repo(db_session: Session) -> AccommodationReposi
 
 
 # Transport Repository
-class TransportRepository(SQLAlchemySyncRepository[Transport]):  # type: ignore
+class TransportRepository(ReturningRepository[Transport]):  # type: ignore
     model_type = Transport
+    spending_travel_key = "travel_id"
 
 
 async def provide_transport_repo(db_session: Session) -> TransportRepository:
@@ -23,8 +149,9 @@ async def provide_transport_repo(db_session: Session) -> TransportRepository:
 
 
 # Activity Repository
-class ActivityRepository(SQLAlchemySyncRepository[Activity]):  # type: ignore
+class ActivityRepository(ReturningRepository[Activity]):  # type: ignore
     model_type = Activity
+    spending_travel_key = "travel_id"
 
 
 async def provide_activity_repo(db_session: Session) -> ActivityRepository:
@@ -32,8 +159,141 @@ async def provide_activity_repo(db_session: Session) -> ActivityRepository:
 
 
 # Expense Repository
-class ExpenseRepository(SQLAlchemySyncRepository[Expense]):  # type: ignore
+class ExpenseRepository(ReturningRepository[Expense]):  # type: ignore
     model_type = Expense
+    spending_travel_key = "travel_id"
+
+    def spending_timeseries(self, travel_id: int, resolution: str = "day", group_by: str = "travel") -> SpendingTimeseries:
+        key = (travel_id, resolution, group_by)
+        version = _spending_version(travel_id)
+        with _spending_lock:
+            cached = _spending_cache.get(key)
+            if cached is not None and cached[0] == version and cached[1] > monotonic():
+                _spending_cache.move_to_end(key)
+                return cached[2]
+
+        def planned(model: type[Accommodation | Transport | Activity]):
+            return (
+                select(func.coalesce(func.sum(model.price), 0))
+                .where(model.travel_id == travel_id)
+                .scalar_subquery()
+            )
+
+        planned_row = self.session.execute(
+            select(planned(Accommodation), planned(Transport), planned(Activity)).where(Travel.id == travel_id)
+        ).one_or_none()
+        if planned_row is None:
+            raise NotFoundError(f"Viaje {travel_id} no encontrado")
+
+        # Agrupación, acumulado y media móvil se resuelven en SQL con funciones de ventana
+        period = func.date(Expense.datetime, *SPENDING_PERIOD_MODIFIERS[resolution])
+        by_user = group_by == "user"
+
+        # Todos los periodos entre el primer y el último gasto (CTE recursiva), para que los
+        # periodos sin gastos cuenten como cero y la ventana cubra periodos de calendario
+        periods = (
+            select(func.min(period).label("period"), func.max(period).label("last"))
+            .where(Expense.travel_id == travel_id)
+            .cte("periods", recursive=True)
+        )
+        periods = periods.union_all(
+            select(func.date(periods.c.period, SPENDING_PERIOD_STEPS[resolution]), periods.c.last).where(
+                periods.c.period < periods.c.last
+            )
+        )
+        if by_user:
+            members = select(Expense.user_id).where(Expense.travel_id == travel_id).distinct().subquery()
+            grid = select(periods.c.period, members.c.user_id).join_from(periods, members, true())
+        else:
+            grid = select(periods.c.period, null().label("user_id"))
+        grid = grid.where(periods.c.period.is_not(None)).subquery()
+
+        keys = [period.label("period"), Expense.user_id] if by_user else [period.label("period")]
+        grouped = (
+            select(*keys, func.sum(Expense.amount).label("total"), func.count(Expense.id).label("count"))
+            .where(Expense.travel_id == travel_id)
+            .group_by(*keys)
+            .subquery()
+        )
+        on = grouped.c.period == grid.c.period
+        if by_user:
+            on = and_(on, grouped.c.user_id == grid.c.user_id)
+        filled = (
+            select(
+                grid.c.period,
+                grid.c.user_id,
+                func.coalesce(grouped.c.total, 0).label("total"),
+                func.coalesce(grouped.c.count, 0).label("count"),
+            )
+            .select_from(grid)
+            .outerjoin(grouped, on)
+            .subquery()
+        )
+
+        partition = [filled.c.user_id] if by_user else []
+        rows = self.session.execute(
+            select(
+                filled.c.period,
+                filled.c.user_id,
+                filled.c.total,
+                filled.c.count,
+                func.sum(filled.c.total)
+                .over(partition_by=partition or None, order_by=filled.c.period, rows=(None, 0))
+                .label("cumulative"),
+                func.avg(filled.c.total)
+                .over(
+                    partition_by=partition or None,
+                    order_by=filled.c.period,
+                    rows=(-(SPENDING_ROLLING_WINDOW - 1), 0),
+                )
+                .label("rolling_average"),
+            ).order_by(*partition, filled.c.period)
+        ).all()
+
+        series = [SpendingPoint(**row._mapping) for row in rows]
+        totals: dict[Optional[int], list[int]] = {}
+        for point in series:
+            totals.setdefault(point.user_id, []).append(point.total)
+
+        statistics = []
+        for group_user_id, values in totals.items():
+            cuts = quantiles(values, n=100, method="inclusive") if len(values) > 1 else [float(values[0])] * 99
+            statistics.append(
+                SpendingStatistics(
+                    user_id=group_user_id,
+                    total=sum(values),
+                    mean=sum(values) / len(values),
+                    min=min(values),
+                    max=max(values),
+                    p50=cuts[49],
+                    p90=cuts[89],
+                    p95=cuts[94],
+                )
+            )
+
+        planned_accommodations, planned_transports, planned_activities = planned_row
+        spent_total = sum(point.total for point in series)
+        planned_total = planned_accommodations + planned_transports + planned_activities
+        result = SpendingTimeseries(
+            travel_id=travel_id,
+            resolution=resolution,
+            group_by=group_by,
+            planned_accommodations=planned_accommodations,
+            planned_transports=planned_transports,
+            planned_activities=planned_activities,
+            planned_total=planned_total,
+            spent_total=spent_total,
+            remaining=planned_total - spent_total,
+            series=series,
+            statistics=statistics,
+        )
+
+        with _spending_lock:
+            _spending_cache[key] = (version, monotonic() + SPENDING_CACHE_TTL, result)
+            _spending_cache.move_to_end(key)
+            if len(_spending_cache) > SPENDING_CACHE_SIZE:
+                _spending_cache.popitem(last=False)
+        return result
 
 
 async def provide_expense_repo(db_session: Session) -> ExpenseRepository:
@@ -41,7 +301,7 @@ async def provide_expense_repo(db_session: Session) -> ExpenseRepository:
 
 
 # City Repository
-class CityRepository(SQLAlchemySyncRepository[City]):  # type: ignore
+class CityRepository(ReturningRepository[City]):  # type: ignore
     model_type = City
 
 
@@ -50,8 +310,9 @@ async def provide_city_repo(db_session: Session) -> CityRepository:
 
 
 # Travel Repository
-class TravelRepository(SQLAlchemySyncRepository[Travel]):  # type: ignore
+class TravelRepository(ReturningRepository[Travel]):  # type: ignore
     model_type = Travel
+    spending_travel_key = "id"
 
 
 async def provide_travel_repo(db_session: Session) -> TravelRepository:
@@ -59,7 +320,7 @@ async def provide_travel_repo(db_session: Session) -> TravelRepository:
 
 
 # User Repository
-class UserRepository(SQLAlchemySyncRepository[User]):  # type: ignore
+class UserRepository(ReturningRepository[User]):  # type: ignore
     model_type = User
 
 
@@ -0,0 +1,86 @@
+"""Benchmark de GET /travels/{id}/spending/timeseries sobre un viaje con muchos gastos.
+
+Uso (desde la raíz del proyecto):
+
+    python -m benchmarks.spending_timeseries --expenses 120000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models import Base, Expense, Travel, User
+from app.repositories import ExpenseRepository, invalidate_spending
+
+
+def seed(session: Session, expenses: int, users: int, days: int) -> int:
+    start = date(2024, 1, 1)
+    session.execute(insert(User), [{"name": f"user{i}", "email": f"user{i}@example.com"} for i in range(users)])
+    travel = Travel(name="benchmark", description=None, start_date=start, end_date=start + timedelta(days=days))
+    session.add(travel)
+    session.flush()
+    chunk = []
+    for i in range(expenses):
+        chunk.append(
+            {
+                "description": f"expense {i}",
+                "amount": random.randint(1, 500),
+                "datetime": start + timedelta(days=random.randrange(days)),
+                "user_id": random.randint(1, users),
+                "travel_id": travel.id,
+            }
+        )
+        if len(chunk) == 10_000:
+            session.execute(insert(Expense.__table__), chunk)
+            chunk.clear()
+    if chunk:
+        session.execute(insert(Expense.__table__), chunk)
+    session.commit()
+    return travel.id
+
+
+def timed(repo: ExpenseRepository, travel_id: int, resolution: str, group_by: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        repo.spending_timeseries(travel_id, resolution=resolution, group_by=group_by)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--expenses", type=int, default=120_000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.sqlite3')}")
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            started = time.perf_counter()
+            travel_id = seed(session, args.expenses, args.users, args.days)
+            print(f"seeded {args.expenses} expenses in {time.perf_counter() - started:.2f}s")
+
+            repo = ExpenseRepository(session=session)
+            print(f"{'resolution':<10} {'group_by':<8} {'uncached (s)':>12} {'cached (s)':>12}")
+            for resolution in ("day", "week", "month"):
+                for group_by in ("travel", "user"):
+                    uncached = float("inf")
+                    for _ in range(args.repeat):
+                        invalidate_spending(travel_id)
+                        uncached = min(uncached, timed(repo, travel_id, resolution, group_by, 1))
+                    cached = timed(repo, travel_id, resolution, group_by, args.repeat)
+                    print(f"{resolution:<10} {group_by:<8} {uncached:>12.4f} {cached:>12.6f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()